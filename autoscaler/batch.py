@@ -0,0 +1,180 @@
+# batch.py
+
+from array import array
+
+try:
+    import numpy as np
+except ImportError:  # fallback su array della stdlib
+    np = None
+
+from utils import mem_inactive_file, psi_some_avg10
+
+NAN = float("nan")
+
+# Contatori grezzi estratti dallo snapshot /stats di ogni container
+FIELDS = (
+    "group", "total", "pre_total", "sys", "pre_sys", "online", "limit_cpus",
+    "mem_usage", "mem_inactive", "mem_limit",
+    "periods", "pre_periods", "throttled", "pre_throttled",
+    "psi_cpu", "psi_mem",
+)
+WIDTH = len(FIELDS)
+
+def _nan_if_none(v):
+    return NAN if v is None else v
+
+class MetricsBatch:
+    """
+    Raccoglie i contatori grezzi di tutti i container di un ciclo in un
+    buffer array('d') contiguo (una riga di FIELDS per container) e calcola
+    in un unico passaggio vettoriale CPU% grezza e normalizzata, MEM% (usage
+    e working set), throttling% e PSI, più le medie per servizio. Con NumPy
+    il buffer è letto senza copie; senza NumPy si usa un loop stdlib con gli
+    stessi risultati di utils.cpu_percent_v151 / mem_percent /
+    normalize_cpu_percent / avg.
+    """
+
+    def __init__(self):
+        self.keys = []          # indice gruppo -> chiave (service_id)
+        self._index = {}
+        self.buf = array("d")   # righe di WIDTH valori, row-major
+
+    def __len__(self):
+        return len(self.buf) // WIDTH
+
+    def add(self, key, stats: dict, limit_cpus: float = 0.0):
+        gi = self._index.get(key)
+        if gi is None:
+            gi = self._index[key] = len(self.keys)
+            self.keys.append(key)
+        cpu = stats.get("cpu_stats", {}) or {}
+        precpu = stats.get("precpu_stats", {}) or {}
+        usage = cpu.get("cpu_usage", {}) or {}
+        mem = stats.get("memory_stats", {}) or {}
+        thr = cpu.get("throttling_data", {}) or {}
+        pre_thr = precpu.get("throttling_data") or {}
+        online = cpu.get("online_cpus")
+        if limit_cpus <= 0:
+            # senza limite noto si normalizza sulle CPU online del nodo
+            limit_cpus = online or 0
+        if not online:
+            online = len(usage.get("percpu_usage", []) or []) or 1
+        # una sola fromlist per container: i valori finiscono nel buffer contiguo
+        self.buf.fromlist([
+            gi,
+            usage.get("total_usage", 0) or 0,
+            (precpu.get("cpu_usage", {}) or {}).get("total_usage", 0) or 0,
+            cpu.get("system_cpu_usage", 0) or 0,
+            precpu.get("system_cpu_usage", 0) or 0,
+            online,
+            limit_cpus,
+            mem.get("usage", 0) or 0,
+            mem_inactive_file(mem),
+            mem.get("limit", 1) or 1,
+            thr.get("periods", 0) or 0,
+            # NaN = campione precedente assente: si usano i contatori cumulativi
+            (pre_thr.get("periods", 0) or 0) if pre_thr else NAN,
+            thr.get("throttled_periods", 0) or 0,
+            pre_thr.get("throttled_periods", 0) or 0,
+            _nan_if_none(psi_some_avg10(stats, "cpu")),
+            _nan_if_none(psi_some_avg10(stats, "memory")),
+        ])
+
+    def compute(self):
+        """
+        Restituisce (per_container, per_service): per_container è un dict
+        metrica -> sequenza allineata all'ordine di add(); per_service è un
+        dict chiave -> medie {cpu, mem, mem_ws, throttle, psi_cpu, psi_mem, n}.
+        """
+        if np is not None:
+            return self._compute_numpy()
+        return self._compute_array()
+
+    # --- NumPy ---
+    def _compute_numpy(self):
+        m = np.frombuffer(self.buf, dtype=np.float64).reshape(-1, WIDTH)
+        c = {f: m[:, i] for i, f in enumerate(FIELDS)}
+        group = c["group"].astype(np.intp)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cpu_delta = c["total"] - c["pre_total"]
+            sys_delta = c["sys"] - c["pre_sys"]
+            ok = (cpu_delta > 0.0) & (sys_delta > 0.0)
+            raw = np.where(ok, cpu_delta / sys_delta * c["online"] * 100.0, 0.0)
+            lim = c["limit_cpus"]
+            norm = np.clip(np.where(lim > 0.0, raw / lim, raw), 0.0, 100.0)
+            mem = c["mem_usage"] / c["mem_limit"] * 100.0
+            inactive = c["mem_inactive"]
+            ws = np.where(inactive < c["mem_usage"], c["mem_usage"] - inactive, c["mem_usage"])
+            mem_ws = ws / c["mem_limit"] * 100.0
+            has_pre = ~np.isnan(c["pre_periods"])
+            periods = np.where(has_pre, c["periods"] - c["pre_periods"], c["periods"])
+            throttled = np.where(has_pre, c["throttled"] - c["pre_throttled"], c["throttled"])
+            thr = np.where(periods > 0.0, np.clip(throttled / periods * 100.0, 0.0, 100.0), 0.0)
+        per_container = {"cpu_raw": raw, "cpu": norm, "mem": mem, "mem_ws": mem_ws,
+                         "throttle": thr, "psi_cpu": c["psi_cpu"], "psi_mem": c["psi_mem"]}
+        ng = len(self.keys)
+        n = np.bincount(group, minlength=ng)
+        means = {}
+        for name in ("cpu", "mem", "mem_ws", "throttle", "psi_cpu", "psi_mem"):
+            vals = per_container[name]
+            valid = ~np.isnan(vals)
+            sums = np.bincount(group[valid], weights=vals[valid], minlength=ng)
+            cnt = np.bincount(group[valid], minlength=ng)
+            means[name] = np.divide(sums, cnt, out=np.zeros(ng), where=cnt > 0)
+        per_service = {}
+        for gi, key in enumerate(self.keys):
+            agg = {name: float(vals[gi]) for name, vals in means.items()}
+            agg["n"] = int(n[gi])
+            per_service[key] = agg
+        return per_container, per_service
+
+    # --- fallback stdlib ---
+    def _compute_array(self):
+        size = len(self)
+        out = {name: array("d", bytes(8 * size))
+               for name in ("cpu_raw", "cpu", "mem", "mem_ws", "throttle")}
+        raw_o, cpu_o, mem_o, ws_o, thr_o = (out["cpu_raw"], out["cpu"], out["mem"],
+                                            out["mem_ws"], out["throttle"])
+        ng = len(self.keys)
+        sums = {name: [0.0] * ng for name in ("cpu", "mem", "mem_ws", "throttle", "psi_cpu", "psi_mem")}
+        cnts = {"psi_cpu": [0] * ng, "psi_mem": [0] * ng}
+        n = [0] * ng
+        psi_cpu_o, psi_mem_o = array("d", bytes(8 * size)), array("d", bytes(8 * size))
+        for i, (g, tot, ptot, sy, psy, onl, lim, mu, mi, ml,
+                per, pper, th, pth, pc, pm) in enumerate(zip(*[iter(self.buf)] * WIDTH)):
+            cd, sd = tot - ptot, sy - psy
+            raw = cd / sd * onl * 100.0 if cd > 0.0 and sd > 0.0 else 0.0
+            norm = raw / lim if lim > 0.0 else raw
+            norm = 0.0 if norm < 0.0 else (100.0 if norm > 100.0 else norm)
+            mem = mu / ml * 100.0
+            ws = (mu - mi if mi < mu else mu) / ml * 100.0
+            if pper == pper:  # campione precedente presente
+                per, th = per - pper, th - pth
+            thr = 0.0
+            if per > 0.0:
+                thr = th / per * 100.0
+                thr = 0.0 if thr < 0.0 else (100.0 if thr > 100.0 else thr)
+            raw_o[i], cpu_o[i], mem_o[i], ws_o[i], thr_o[i] = raw, norm, mem, ws, thr
+            psi_cpu_o[i], psi_mem_o[i] = pc, pm
+            g = int(g)
+            n[g] += 1
+            sums["cpu"][g] += norm
+            sums["mem"][g] += mem
+            sums["mem_ws"][g] += ws
+            sums["throttle"][g] += thr
+            if pc == pc:  # non NaN
+                sums["psi_cpu"][g] += pc
+                cnts["psi_cpu"][g] += 1
+            if pm == pm:
+                sums["psi_mem"][g] += pm
+                cnts["psi_mem"][g] += 1
+        out["psi_cpu"], out["psi_mem"] = psi_cpu_o, psi_mem_o
+        per_service = {}
+        for gi, key in enumerate(self.keys):
+            agg = {}
+            for name, s in sums.items():
+                cnt = cnts[name][gi] if name in cnts else n[gi]
+                agg[name] = s[gi] / cnt if cnt else 0.0
+            agg["n"] = n[gi]
+            per_service[key] = agg
+        return out, per_service
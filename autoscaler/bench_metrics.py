@@ -0,0 +1,84 @@
+# bench_metrics.py
+#
+# Micro-benchmark: calcolo per-container con le funzioni di utils contro il
+# calcolo batch di MetricsBatch, su snapshot /stats sintetici.
+#   python bench_metrics.py [containers] [services] [rounds]
+
+import random, sys, time
+import batch
+from batch import MetricsBatch
+from utils import (cpu_percent_v151, mem_percent, mem_working_set_percent,
+                   cpu_throttling_percent, normalize_cpu_percent, avg)
+
+def fake_stats(rnd: random.Random) -> dict:
+    online = rnd.choice([2, 4, 8, 16])
+    pre_total = rnd.randint(10**9, 10**12)
+    pre_sys = rnd.randint(10**12, 10**14)
+    periods = rnd.randint(1000, 100000)
+    throttled = rnd.randint(0, periods)
+    grow = rnd.choice([0, 100])  # 0 = nessun periodo CFS nella finestra (idle)
+    limit = rnd.choice([256, 512, 1024, 4096]) * 2**20
+    usage = rnd.randint(2**20, limit)
+    return {
+        "cpu_stats": {
+            "cpu_usage": {"total_usage": pre_total + rnd.randint(0, 10**9)},
+            "system_cpu_usage": pre_sys + 10**9 * online,
+            "online_cpus": online,
+            "throttling_data": {"periods": periods + grow, "throttled_periods": throttled + rnd.randint(0, grow)},
+        },
+        "precpu_stats": {
+            "cpu_usage": {"total_usage": pre_total},
+            "system_cpu_usage": pre_sys,
+            "throttling_data": {"periods": periods, "throttled_periods": throttled},
+        },
+        "memory_stats": {"usage": usage, "limit": limit,
+                         "stats": {"inactive_file": rnd.randint(0, usage)}},
+    }
+
+def per_container(samples):
+    by_svc = {}
+    for svc, s, limit_cpus in samples:
+        vals = by_svc.setdefault(svc, ([], [], [], []))
+        vals[0].append(normalize_cpu_percent(cpu_percent_v151(s), limit_cpus))
+        vals[1].append(mem_percent(s))
+        vals[2].append(mem_working_set_percent(s))
+        vals[3].append(cpu_throttling_percent(s))
+    return {svc: tuple(avg(v) for v in vals) for svc, vals in by_svc.items()}
+
+def batched(samples):
+    b = MetricsBatch()
+    for svc, s, limit_cpus in samples:
+        b.add(svc, s, limit_cpus)
+    return b.compute()[1]
+
+def timeit(fn, samples, rounds):
+    best = float("inf")
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        fn(samples)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    services = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    rounds = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    rnd = random.Random(42)
+    samples = [(f"svc{rnd.randrange(services)}", fake_stats(rnd), rnd.choice([0.5, 1.0, 2.0]))
+               for _ in range(n)]
+
+    ref, got = per_container(samples), batched(samples)
+    for svc, (cpu, mem, ws, thr) in ref.items():
+        g = got[svc]
+        for a, b in ((cpu, g["cpu"]), (mem, g["mem"]), (ws, g["mem_ws"]), (thr, g["throttle"])):
+            assert abs(a - b) <= 1e-6 * max(1.0, abs(a)), (svc, a, b)
+
+    t_ref = timeit(per_container, samples, rounds)
+    t_batch = timeit(batched, samples, rounds)
+    backend = "numpy" if batch.np is not None else "array"
+    print(f"containers={n} services={services} backend={backend}")
+    print(f"per-container: {t_ref * 1e3:.2f} ms")
+    print(f"batch:         {t_batch * 1e3:.2f} ms  (x{t_ref / t_batch:.2f})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+# capacity.py
+
+import time
+
+# Stati task che non occupano più risorse su un nodo
+TERMINAL_STATES = {"complete", "failed", "shutdown", "rejected", "orphaned", "remove"}
+
+def reservations_from_template(task_template: dict) -> tuple:
+    """
+    Restituisce (NanoCPUs, MemoryBytes) riservati per task dal TaskTemplate
+    del servizio; 0 se la reservation non è dichiarata.
+    """
+    res = ((task_template or {}).get("Resources") or {}).get("Reservations") or {}
+    return int(res.get("NanoCPUs") or 0), int(res.get("MemoryBytes") or 0)
+
+def node_schedulable(node: dict) -> bool:
+    spec = node.get("Spec") or {}
+    state = (node.get("Status") or {}).get("State")
+    return state == "ready" and spec.get("Availability", "active") == "active"
+
+_NODE_KEYS = {"node.id", "node.hostname", "node.role", "node.platform.os", "node.platform.arch"}
+
+def _node_attr(node: dict, key: str):
+    spec = node.get("Spec") or {}
+    desc = node.get("Description") or {}
+    if key == "node.id":
+        return node.get("ID")
+    if key == "node.hostname":
+        return desc.get("Hostname")
+    if key == "node.role":
+        return spec.get("Role")
+    if key == "node.platform.os":
+        return (desc.get("Platform") or {}).get("OS")
+    if key == "node.platform.arch":
+        return (desc.get("Platform") or {}).get("Architecture")
+    if key.startswith("node.labels."):
+        return (spec.get("Labels") or {}).get(key[len("node.labels."):])
+    if key.startswith("engine.labels."):
+        return ((desc.get("Engine") or {}).get("Labels") or {}).get(key[len("engine.labels."):])
+    return None
+
+def node_matches_constraints(node: dict, constraints) -> bool:
+    """
+    Valuta i placement constraint Swarm (==, !=) sugli attributi noti del nodo.
+    Constraint su attributi sconosciuti vengono ignorati (fail-open).
+    """
+    for c in constraints or []:
+        if "!=" in c:
+            key, want = c.split("!=", 1)
+            op = "!="
+        elif "==" in c:
+            key, want = c.split("==", 1)
+            op = "=="
+        else:
+            continue
+        key, want = key.strip(), want.strip().lower()
+        if key not in _NODE_KEYS and not key.startswith(("node.labels.", "engine.labels.")):
+            continue
+        actual = _node_attr(node, key)
+        actual = str(actual).lower() if actual is not None else None
+        if op == "==" and actual != want:
+            return False
+        if op == "!=" and actual == want:
+            return False
+    return True
+
+class ClusterCapacity:
+    """
+    Modello aggregato della capacità del cluster: risorse allocabili dei nodi
+    (da /nodes, con TTL) meno le reservation dei task attivi (da /tasks).
+    I task sono indicizzati per ID e ricalcolati solo quando cambia la loro
+    Version, così l'aggiornamento per ciclo è incrementale.
+    """
+
+    def __init__(self, nodes_ttl: float = 60.0):
+        self.nodes_ttl = float(nodes_ttl)
+        self.nodes = {}        # node_id -> node
+        self.nodes_ts = 0.0
+        self.tasks = {}        # task_id -> entry
+        self.used = {}         # node_id -> [nano_cpus, mem_bytes]
+        self.placed = {}       # (node_id, service_id) -> task attivi
+        self.claimed = {}      # node_id -> [nano_cpus, mem_bytes] prenotati nel ciclo corrente
+        self.claimed_tasks = {}  # (node_id, service_id) -> n
+        self.ready = False
+
+    # --- aggiornamento stato ---
+    def nodes_stale(self, now=None) -> bool:
+        now = time.time() if now is None else now
+        return not self.nodes or (now - self.nodes_ts) >= self.nodes_ttl
+
+    def update_nodes(self, nodes: list, now=None):
+        self.nodes = {n.get("ID"): n for n in nodes or [] if n.get("ID")}
+        self.nodes_ts = time.time() if now is None else now
+
+    def update_tasks(self, tasks: list):
+        seen = set()
+        for t in tasks or []:
+            tid = t.get("ID")
+            if not tid:
+                continue
+            seen.add(tid)
+            ver = (t.get("Version") or {}).get("Index")
+            cur = self.tasks.get(tid)
+            if cur and cur["version"] == ver:
+                continue
+            if cur:
+                self._account(cur, -1)
+            entry = self._task_entry(t, ver)
+            self.tasks[tid] = entry
+            self._account(entry, +1)
+        for tid in [x for x in self.tasks if x not in seen]:
+            self._account(self.tasks.pop(tid), -1)
+        # le prenotazioni del ciclo precedente sono ora visibili come task
+        self.claimed.clear()
+        self.claimed_tasks.clear()
+        self.ready = True
+
+    def _task_entry(self, t: dict, ver) -> dict:
+        st = t.get("Status") or {}
+        cpu, mem = reservations_from_template(t.get("Spec") or {})
+        return {
+            "version": ver,
+            "service_id": t.get("ServiceID"),
+            "node_id": t.get("NodeID"),
+            "state": st.get("State"),
+            "err": st.get("Err") or "",
+            "cpu": cpu,
+            "mem": mem,
+        }
+
+    def _account(self, entry: dict, sign: int):
+        nid = entry["node_id"]
+        if not nid or entry["state"] in TERMINAL_STATES:
+            return
+        u = self.used.setdefault(nid, [0, 0])
+        u[0] += sign * entry["cpu"]
+        u[1] += sign * entry["mem"]
+        key = (nid, entry["service_id"])
+        n = self.placed.get(key, 0) + sign
+        if n > 0:
+            self.placed[key] = n
+        else:
+            self.placed.pop(key, None)
+
+    # --- interrogazioni ---
+    def pending_tasks(self, service_id: str) -> list:
+        return [e for e in self.tasks.values()
+                if e["service_id"] == service_id and e["state"] == "pending"]
+
+    def unschedulable_tasks(self, service_id: str) -> list:
+        return [e for e in self.pending_tasks(service_id) if "no suitable node" in e["err"]]
+
+    def free_on_node(self, node_id: str) -> tuple:
+        res = ((self.nodes.get(node_id) or {}).get("Description") or {}).get("Resources") or {}
+        used = self.used.get(node_id, [0, 0])
+        claimed = self.claimed.get(node_id, [0, 0])
+        cpu = int(res.get("NanoCPUs") or 0) - used[0] - claimed[0]
+        mem = int(res.get("MemoryBytes") or 0) - used[1] - claimed[1]
+        return cpu, mem
+
+    def _service_tasks_on(self, node_id: str, service_id: str) -> int:
+        key = (node_id, service_id)
+        return self.placed.get(key, 0) + self.claimed_tasks.get(key, 0)
+
+    def _slots_on(self, node_id: str, service_id: str, cpu: int, mem: int, max_per_node: int):
+        """Repliche aggiuntive collocabili sul nodo; None se illimitate."""
+        free_cpu, free_mem = self.free_on_node(node_id)
+        slots = None
+        if cpu > 0:
+            slots = max(0, free_cpu // cpu)
+        if mem > 0:
+            m = max(0, free_mem // mem)
+            slots = m if slots is None else min(slots, m)
+        if max_per_node > 0:
+            left = max(0, max_per_node - self._service_tasks_on(node_id, service_id))
+            slots = left if slots is None else min(slots, left)
+        return slots
+
+    def _eligible_nodes(self, spec: dict) -> list:
+        placement = ((spec or {}).get("TaskTemplate") or {}).get("Placement") or {}
+        constraints = placement.get("Constraints") or []
+        return [nid for nid, n in self.nodes.items()
+                if node_schedulable(n) and node_matches_constraints(n, constraints)]
+
+    def checkpoint(self):
+        """Stato delle prenotazioni del ciclo, per annullare una claim di gruppo parziale."""
+        return {k: list(v) for k, v in self.claimed.items()}, dict(self.claimed_tasks)
+
+    def rollback(self, cp):
+        self.claimed, self.claimed_tasks = cp
+
+    def claim(self, service_id: str, spec: dict, wanted: int) -> int:
+        """
+        Prenota fino a `wanted` repliche nel ciclo corrente, distribuendole come
+        lo scheduler spread (nodo con meno task del servizio), e restituisce
+        quante ne entrano davvero.
+        """
+        tt = (spec or {}).get("TaskTemplate") or {}
+        cpu, mem = reservations_from_template(tt)
+        max_per_node = int((tt.get("Placement") or {}).get("MaxReplicas") or 0)
+        nodes = self._eligible_nodes(spec)
+        granted = 0
+        for _ in range(max(0, int(wanted))):
+            fits = [nid for nid in nodes
+                    if self._slots_on(nid, service_id, cpu, mem, max_per_node) != 0]
+            if not fits:
+                break
+            nid = min(fits, key=lambda x: self._service_tasks_on(x, service_id))
+            c = self.claimed.setdefault(nid, [0, 0])
+            c[0] += cpu
+            c[1] += mem
+            key = (nid, service_id)
+            self.claimed_tasks[key] = self.claimed_tasks.get(key, 0) + 1
+            granted += 1
+        return granted
+
+    def release(self, service_id: str, spec: dict, n: int):
+        """
+        Annulla `n` prenotazioni del servizio fatte nel ciclo corrente (es. update
+        fallito), partendo dal nodo su cui ne ha di più.
+        """
+        cpu, mem = reservations_from_template((spec or {}).get("TaskTemplate") or {})
+        for _ in range(max(0, int(n))):
+            keys = [k for k in self.claimed_tasks if k[1] == service_id]
+            if not keys:
+                break
+            key = max(keys, key=lambda k: self.claimed_tasks[k])
+            left = self.claimed_tasks[key] - 1
+            if left > 0:
+                self.claimed_tasks[key] = left
+            else:
+                self.claimed_tasks.pop(key)
+            c = self.claimed[key[0]]
+            c[0] -= cpu
+            c[1] -= mem
@@ -1,24 +1,15 @@
 # /app/healthcheck.py
-import os, sys, socket, urllib.request
+import os, sys, urllib.request
 
-def manager_ping():
-    base = os.getenv("MANAGER_PROXY_HOST", "http://dsproxy_rw:2375").rstrip("/")
-    url = f"{base}/_ping"
+def autoscaler_healthz():
+    # /healthz dell'admin API: lag dell'event loop ed età dell'ultimo ciclo riuscito
+    port = int(os.getenv("ADMIN_API_PORT", "9090"))
+    url = f"http://127.0.0.1:{port}/healthz"
     try:
-        with urllib.request.urlopen(url, timeout=2) as r:
-            body = r.read().decode(errors="ignore").strip().upper()
-            return body == "OK"
+        with urllib.request.urlopen(url, timeout=5) as r:
+            return r.status == 200
     except Exception:
         return False
 
-def ro_dns_resolves():
-    name = os.getenv("READONLY_PROXY_DNS", "tasks.dsproxy_ro")
-    port = int(os.getenv("READONLY_PROXY_PORT", "2375"))
-    try:
-        infos = socket.getaddrinfo(name, port, proto=socket.IPPROTO_TCP)
-        return len(infos) > 0
-    except Exception:
-        return False
-
-ok = manager_ping() and ro_dns_resolves()
+ok = autoscaler_healthz()
 sys.exit(0 if ok else 1)
@@ -0,0 +1,99 @@
+# loopmon.py
+
+import asyncio, logging, sys, threading, time, traceback
+
+log = logging.getLogger("autoscaler")
+
+class LoopMonitor:
+    """
+    Liveness dell'event loop: campiona la latenza dello scheduling (lag),
+    registra durata ed esito di ogni ciclo di riconciliazione e, tramite un
+    thread watchdog, segnala le callback che bloccano il loop oltre soglia
+    riportando lo stack del thread del loop (quindi la coroutine colpevole).
+    """
+
+    def __init__(self, sample_interval: float = 1.0, slow_callback: float = 0.5,
+                 max_lag: float = 2.0, max_cycle_age: float = 300.0):
+        self.sample_interval = float(sample_interval)
+        self.slow_callback = float(slow_callback)
+        self.max_lag = float(max_lag)
+        self.max_cycle_age = float(max_cycle_age)
+        self.started_ts = time.time()
+        self.lag = 0.0
+        self.max_lag_seen = 0.0     # massimo dall'ultimo ciclo completato
+        self.heartbeat = time.monotonic()
+        self.last_cycle_ts = None
+        self.last_success_ts = None
+        self.last_cycle_duration = None
+        self.last_cycle_ok = None
+        self.cycles = 0
+        self.failures = 0
+        self._loop_thread_id = None
+
+    def start(self):
+        self._loop_thread_id = threading.get_ident()
+        asyncio.get_running_loop().create_task(self._sample_lag())
+        if self.slow_callback > 0:
+            threading.Thread(target=self._watchdog, name="loop-watchdog", daemon=True).start()
+
+    async def _sample_lag(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            t0 = loop.time()
+            await asyncio.sleep(self.sample_interval)
+            self.heartbeat = time.monotonic()
+            self.lag = max(0.0, loop.time() - t0 - self.sample_interval)
+            self.max_lag_seen = max(self.max_lag_seen, self.lag)
+            if self.lag > self.max_lag:
+                log.warning(f"event loop lag {self.lag:.2f}s (threshold {self.max_lag:.2f}s)")
+
+    def _watchdog(self):
+        # il loop aggiorna heartbeat ogni sample_interval; se resta fermo oltre
+        # la soglia qualcosa sta bloccando il thread del loop
+        reported = None
+        while True:
+            time.sleep(max(0.05, self.slow_callback / 2))
+            hb = self.heartbeat
+            stalled = time.monotonic() - hb - self.sample_interval
+            if stalled < self.slow_callback or reported == hb:
+                continue
+            reported = hb
+            frame = sys._current_frames().get(self._loop_thread_id)
+            where = "".join(traceback.format_stack(frame, limit=8)) if frame else "<unknown>"
+            log.warning(f"event loop blocked for {stalled:.2f}s, running:\n{where}")
+
+    def cycle_done(self, duration: float, ok: bool):
+        now = time.time()
+        self.cycles += 1
+        self.last_cycle_ts = now
+        self.last_cycle_duration = duration
+        self.last_cycle_ok = ok
+        self.max_lag_seen = self.lag
+        if ok:
+            self.last_success_ts = now
+        else:
+            self.failures += 1
+
+    def health(self, now=None) -> dict:
+        now = time.time() if now is None else now
+        ref = self.last_success_ts if self.last_success_ts is not None else self.started_ts
+        age = now - ref
+        stalled = max(0.0, time.monotonic() - self.heartbeat - self.sample_interval)
+        problems = []
+        if age > self.max_cycle_age:
+            problems.append(f"no successful cycle for {age:.0f}s")
+        if self.lag > self.max_lag or stalled > self.max_lag:
+            problems.append(f"event loop lag {max(self.lag, stalled):.2f}s")
+        return {
+            "ok": not problems,
+            "problems": problems,
+            "loop_lag_seconds": round(self.lag, 4),
+            "loop_lag_max_seconds": round(self.max_lag_seen, 4),
+            "last_success_age_seconds": round(age, 1) if self.last_success_ts is not None else None,
+            "last_cycle_duration_seconds": (round(self.last_cycle_duration, 3)
+                                            if self.last_cycle_duration is not None else None),
+            "last_cycle_ok": self.last_cycle_ok,
+            "cycles": self.cycles,
+            "failures": self.failures,
+            "thresholds": {"max_lag": self.max_lag, "max_cycle_age": self.max_cycle_age},
+        }
@@ -1,8 +1,12 @@
-import os, asyncio, aiohttp, logging, json, socket, time, smtplib, sys
+import os, asyncio, aiohttp, logging, json, socket, time, smtplib, sys, math
 import yaml
 from email.mime.text import MIMEText
 from aiohttp import web
-from utils import cpu_percent_v151, mem_percent, avg, parse_cpuset
+from utils import parse_cpuset
+from batch import MetricsBatch
+from loopmon import LoopMonitor
+from capacity import ClusterCapacity
+from warmup import WarmupTracker, container_ready
 
 # -----------------------
 # Config e logging
@@ -20,24 +24,42 @@ DEFAULT_COOLDOWN = int(os.getenv("DEFAULT_COOLDOWN","120"))
 LABEL_PREFIX = os.getenv("LABEL_PREFIX","autoscale")
 DEFAULT_MIN = int(os.getenv("DEFAULT_MIN_REPLICAS","1"))
 DEFAULT_MAX = int(os.getenv("DEFAULT_MAX_REPLICAS","50"))
+DEFAULT_MEM_SIGNAL = os.getenv("DEFAULT_MEM_SIGNAL","working_set").lower()  # working_set | usage
 
 SMTP_CONFIG_PATH = os.getenv("SMTP_CONFIG_PATH", "/config/smtp.yml")
 ADMIN_API_PORT = int(os.getenv("ADMIN_API_PORT", "9090"))
 STARTUP_PROXY_WAIT = int(os.getenv("STARTUP_PROXY_WAIT", "60"))  # secondi max di attesa proxy a startup
+BELOW_MIN_ALERT_COOLDOWN = int(os.getenv("BELOW_MIN_ALERT_COOLDOWN", "900"))
+CAPACITY_AWARE = os.getenv("CAPACITY_AWARE", "true").lower() != "false"
+CAPACITY_NODES_TTL = int(os.getenv("CAPACITY_NODES_TTL", "60"))  # secondi tra due refresh di /nodes
+DEFAULT_STABILIZATION = int(os.getenv("DEFAULT_STABILIZATION", "30"))  # margine dopo che le nuove repliche sono pronte
+HEALTH_MAX_LOOP_LAG = float(os.getenv("HEALTH_MAX_LOOP_LAG", "2"))  # secondi di lag oltre cui /healthz fallisce
+HEALTH_MAX_CYCLE_AGE = int(os.getenv("HEALTH_MAX_CYCLE_AGE", "300"))  # secondi max dall'ultimo ciclo riuscito
+LOOP_SLOW_CALLBACK = float(os.getenv("LOOP_SLOW_CALLBACK", "0.5"))  # blocco del loop da segnalare (0 = off)
 
 # Stato runtime
 last_scale_ts = {}
 pending_down = {}
+below_min_last_ts = {}
+capacity = ClusterCapacity(nodes_ttl=CAPACITY_NODES_TTL)
+warmups = WarmupTracker()
+# tra due cicli passano POLL_INTERVAL + durata ciclo: la soglia non può scendere sotto
+HEALTH_CYCLE_AGE_LIMIT = max(HEALTH_MAX_CYCLE_AGE, 2 * POLL_INTERVAL + 60)
+loop_monitor = LoopMonitor(slow_callback=LOOP_SLOW_CALLBACK, max_lag=HEALTH_MAX_LOOP_LAG,
+                           max_cycle_age=HEALTH_CYCLE_AGE_LIMIT)
 smtp_conf = {}
 notifier = None
 
 # -----------------------
 # Utilità HTTP/API
 # -----------------------
-def resolve_ro_proxies():
+async def resolve_ro_proxies():
     ips = set()
     try:
-        for res in socket.getaddrinfo(READONLY_DNS, READONLY_PORT, proto=socket.IPPROTO_TCP):
+        # risoluzione nel threadpool del loop: getaddrinfo è bloccante
+        infos = await asyncio.get_running_loop().getaddrinfo(
+            READONLY_DNS, READONLY_PORT, proto=socket.IPPROTO_TCP)
+        for res in infos:
             ip = res[4][0]
             ips.add(ip)
     except Exception as e:
@@ -98,6 +120,14 @@ async def list_running_tasks(session, service_id):
     params = {"filters": json.dumps(filters)}
     return await http_get_json(session, MANAGER_PROXY, "/tasks", params=params)
 
+async def list_nodes(session):
+    return await http_get_json(session, MANAGER_PROXY, "/nodes")
+
+async def list_cluster_tasks(session):
+    filters = {"desired-state": ["running"]}
+    params = {"filters": json.dumps(filters)}
+    return await http_get_json(session, MANAGER_PROXY, "/tasks", params=params)
+
 async def container_stats_once(session, base, cid):
     params = {"stream": "false"}  # consente precpu_stats
     return await http_get_json(session, base, f"/containers/{cid}/stats", params=params)
@@ -181,18 +211,87 @@ def limit_cpus_from_inspect(ins):
         return float(cnt)
     return 0.0
 
-def online_cpus_from_stats(stats):
-    cpu = stats.get("cpu_stats", {}) or {}
-    oc = cpu.get("online_cpus")
+
+# -----------------------
+# Capacità cluster (headroom + task pending)
+# -----------------------
+async def refresh_capacity(session):
+    if not CAPACITY_AWARE:
+        return
     try:
-        return float(oc) if oc else 0.0
-    except:
-        return 0.0
+        if capacity.nodes_stale():
+            capacity.update_nodes(await list_nodes(session))
+        capacity.update_tasks(await list_cluster_tasks(session))
+    except Exception as e:
+        # modello non affidabile: si torna al comportamento senza cap
+        capacity.ready = False
+        log.warning(f"capacity refresh failed: {e}")
 
-def normalize_cpu_percent(raw_pct: float, limit_cpus: float) -> float:
-    if limit_cpus <= 0:
-        return max(0.0, min(100.0, raw_pct))
-    return max(0.0, min(100.0, raw_pct / limit_cpus))
+def scale_up_pressure(avg_cpu, avg_mem, cpu_max, mem_max, avg_throttle=0.0, throttle_max=None,
+                      avg_psi_cpu=0.0, psi_cpu_max=None, avg_psi_mem=0.0, psi_mem_max=None):
+    cpu_p = avg_cpu / cpu_max if cpu_max > 0 else 0.0
+    mem_p = avg_mem / mem_max if mem_max > 0 else 0.0
+    thr_p = avg_throttle / throttle_max if throttle_max else 0.0
+    psi_cpu_p = avg_psi_cpu / psi_cpu_max if psi_cpu_max else 0.0
+    psi_mem_p = avg_psi_mem / psi_mem_max if psi_mem_max else 0.0
+    return max(cpu_p, mem_p, thr_p, psi_cpu_p, psi_mem_p)
+
+# -----------------------
+# Gruppi di servizi scalati insieme (autoscale.group)
+# -----------------------
+def build_groups(services):
+    """
+    Raggruppa i servizi per label group: un leader (group.leader=true) decide
+    sulle proprie metriche, i follower seguono con repliche = leader * group.ratio.
+    """
+    groups = {}
+    for svc in sorted(services, key=lambda x: (x.get("Spec") or {}).get("Name") or ""):
+        spec = svc.get("Spec") or {}
+        labels = spec.get("Labels") or {}
+        gname = read_label(labels, "group", "", str)
+        if not gname:
+            continue
+        g = groups.setdefault(gname, {"leader": None, "followers": {}})
+        is_leader = read_label(labels, "group.leader", False, lambda v: str(v).lower() == "true")
+        if is_leader and g["leader"] is None:
+            g["leader"] = svc.get("ID")
+            continue
+        if is_leader:
+            log.warning(f"group {gname}: multiple leaders, {spec.get('Name')} treated as follower")
+        g["followers"][svc.get("ID")] = read_label(labels, "group.ratio", 1.0, float)
+    for gname, g in groups.items():
+        if g["leader"] is None:
+            log.warning(f"group {gname} has no leader (autoscale.group.leader=true); members scale independently")
+    return groups
+
+def group_follower_of(groups, labels, svc_id):
+    g = groups.get(read_label(labels, "group", "", str))
+    return g if g and g["leader"] and svc_id in g["followers"] else None
+
+def service_desired(spec):
+    return int(((spec.get("Mode") or {}).get("Replicated") or {}).get("Replicas", 1))
+
+def group_target(leader_replicas, ratio, labels):
+    # tolleranza per evitare che 3 * 0.3333 arrotondi a 2
+    target = math.ceil(leader_replicas * ratio - 1e-9)
+    lo = read_label(labels, "min", DEFAULT_MIN, int)
+    hi = read_label(labels, "max", DEFAULT_MAX, int)
+    return max(lo, min(hi, target))
+
+def group_plan(groups, ctx_by_id, leader_id, leader_replicas):
+    """[(ctx, attuali, target)] per i follower del gruppo guidato da leader_id."""
+    plan = []
+    for g in groups.values():
+        if g["leader"] != leader_id:
+            continue
+        for fid, ratio in g["followers"].items():
+            c = ctx_by_id.get(fid)
+            if not c or "target" in c:
+                continue
+            spec = c["svc"].get("Spec") or {}
+            labels = spec.get("Labels") or {}
+            plan.append((c, service_desired(spec), group_target(leader_replicas, ratio, labels)))
+    return plan
 
 # -----------------------
 # Email notifier con batching + template error
@@ -341,8 +440,13 @@ def iso_now():
     return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
 
 # -----------------------
-# Admin API (test email)
+# Admin API (test email, healthz)
 # -----------------------
+async def handle_healthz(request: web.Request):
+    m: LoopMonitor = request.app["monitor"]
+    h = m.health()
+    return web.json_response(h, status=200 if h["ok"] else 503)
+
 async def handle_test_email(request: web.Request):
     n: EmailNotifier = request.app["notifier"]
     if not n or not n.enabled:
@@ -366,6 +470,8 @@ async def handle_test_email(request: web.Request):
 async def start_admin_api(app_notifier: EmailNotifier, port: int):
     app = web.Application()
     app["notifier"] = app_notifier
+    app["monitor"] = loop_monitor
+    app.router.add_get("/healthz", handle_healthz)
     app.router.add_get("/api/test-email", handle_test_email)
     app.router.add_post("/api/test-email", handle_test_email)
     runner = web.AppRunner(app)
@@ -452,64 +558,98 @@ async def graceful_scale_down(session, node_map, service_id, spec, name, labels,
 # -----------------------
 # Riconciliazione per servizio
 # -----------------------
-async def reconcile_service(session, node_map, svc):
+async def collect_service_metrics(session, node_map, svc, batch):
+    """
+    Raccoglie task e stats grezze delle repliche del servizio nel batch del
+    ciclo; le metriche sono poi calcolate in un solo passaggio per tutti i servizi.
+    """
     svc_id = svc.get("ID")
     spec = svc.get("Spec") or {}
-    labels = spec.get("Labels") or {}
-    name = spec.get("Name")
-
-    cpu_max = read_label(labels, "cpu.max", 80, int)
-    cpu_min = read_label(labels, "cpu.min", 20, int)
-    mem_max = read_label(labels, "mem.max", 80, int)
-    mem_min = read_label(labels, "mem.min", 20, int)
-    min_rep = read_label(labels, "min", DEFAULT_MIN, int)
-    max_rep = read_label(labels, "max", DEFAULT_MAX, int)
-    cooldown = read_label(labels, "cooldown", DEFAULT_COOLDOWN, int)
-
-    scale_down_enabled = read_label(labels, "scale_down.enable", True, lambda v: str(v).lower() != "false")
-    pre_cmd = read_label(labels, "pre_stop.cmd", "", str)
-    pre_timeout = read_label(labels, "pre_stop.timeout", 600, int)
-    stop_timeout = read_label(labels, "stop.timeout", 30, int)
-
-    mode = (spec.get("Mode") or {}).get("Replicated") or {}
-    desired = int(mode.get("Replicas", 1))
-
     svc_limit_cpus = service_limit_cpus_from_spec(spec)
 
     tasks = await list_running_tasks(session, svc_id)
-    cpu_vals, mem_vals = [], []
+    warming = 0
     for t in tasks:
         st = t.get("Status") or {}
         cs = st.get("ContainerStatus") or {}
         cid = cs.get("ContainerID")
         nid = t.get("NodeID")
         base = node_map.get(nid)
+        tid = t.get("ID")
+        ins = None
+        if warmups.is_warming(svc_id, tid):
+            # replica nata dall'ultimo scale-up: esclusa dalle medie finché non è pronta
+            if st.get("State") != "running" or not cid or not base:
+                warming += 1
+                continue
+            try:
+                ins = await container_inspect(session, base, cid)
+            except Exception as e:
+                log.debug(f"inspect failed for warming {cid}@{base}: {e}")
+            if not container_ready(ins):
+                warming += 1
+                continue
+            warmups.mark_live(svc_id, tid)
         if not cid or not base:
             continue
         try:
             s = await container_stats_once(session, base, cid)
-            raw_cpu = cpu_percent_v151(s)
             limit_cpus = svc_limit_cpus
             if limit_cpus <= 0:
                 try:
-                    ins = await container_inspect(session, base, cid)
+                    if ins is None:
+                        ins = await container_inspect(session, base, cid)
                     limit_cpus = limit_cpus_from_inspect(ins)
                 except Exception:
                     limit_cpus = 0.0
-            if limit_cpus <= 0:
-                oc = online_cpus_from_stats(s)
-                if oc > 0:
-                    limit_cpus = oc
-            norm_cpu = normalize_cpu_percent(raw_cpu, limit_cpus)
-            cpu_vals.append(norm_cpu)
-            mem_vals.append(mem_percent(s))
+            # senza limite noto il batch ripiega su online_cpus
+            batch.add(svc_id, s, limit_cpus)
         except Exception as e:
             log.debug(f"stats/inspect failed for {cid}@{base}: {e}")
+    return {"svc": svc, "node_map": node_map, "tasks": tasks, "warming": warming}
+
+async def reconcile_service(session, ctx, agg, scale_ups, groups):
+    svc = ctx["svc"]
+    svc_id = svc.get("ID")
+    spec = svc.get("Spec") or {}
+    labels = spec.get("Labels") or {}
+    name = spec.get("Name")
+
+    cpu_max = read_label(labels, "cpu.max", 80, int)
+    cpu_min = read_label(labels, "cpu.min", 20, int)
+    mem_max = read_label(labels, "mem.max", 80, int)
+    mem_min = read_label(labels, "mem.min", 20, int)
+    mem_signal = read_label(labels, "mem.signal", DEFAULT_MEM_SIGNAL, lambda v: str(v).lower())
+    throttle_max = read_label(labels, "throttle.max", None, float)
+    psi_cpu_max = read_label(labels, "psi.cpu.max", None, float)
+    psi_mem_max = read_label(labels, "psi.mem.max", None, float)
+    min_rep = read_label(labels, "min", DEFAULT_MIN, int)
+    max_rep = read_label(labels, "max", DEFAULT_MAX, int)
+    cooldown = read_label(labels, "cooldown", DEFAULT_COOLDOWN, int)
+    priority = read_label(labels, "priority", 0, int)
+    dynamic_cooldown = read_label(labels, "cooldown.dynamic", True, lambda v: str(v).lower() != "false")
+    stabilization = read_label(labels, "cooldown.stabilization", DEFAULT_STABILIZATION, int)
+
+    scale_down_enabled = read_label(labels, "scale_down.enable", True, lambda v: str(v).lower() != "false")
+    pre_cmd = read_label(labels, "pre_stop.cmd", "", str)
+    pre_timeout = read_label(labels, "pre_stop.timeout", 600, int)
+    stop_timeout = read_label(labels, "stop.timeout", 30, int)
+
+    mode = (spec.get("Mode") or {}).get("Replicated") or {}
+    desired = int(mode.get("Replicas", 1))
 
-    avg_cpu = avg(cpu_vals)
-    avg_mem = avg(mem_vals)
+    tasks = ctx["tasks"]
+    warming = ctx["warming"]
+    agg = agg or {}
+    avg_cpu = agg.get("cpu", 0.0)
+    avg_mem = agg.get("mem", 0.0) if mem_signal == "usage" else agg.get("mem_ws", 0.0)
+    avg_throttle = agg.get("throttle", 0.0)
+    avg_psi_cpu = agg.get("psi_cpu", 0.0)
+    avg_psi_mem = agg.get("psi_mem", 0.0)
     # Passato a DEBUG
-    log.debug(f"{name} cpu={avg_cpu:.1f}% mem={avg_mem:.1f}% desired={desired} running={len(tasks)}")
+    log.debug(f"{name} cpu={avg_cpu:.1f}% mem={avg_mem:.1f}% throttled={avg_throttle:.1f}% "
+              f"psi_cpu={avg_psi_cpu:.1f} psi_mem={avg_psi_mem:.1f} desired={desired} "
+              f"running={len(tasks)} warming={warming}")
 
     running = len(tasks)
     now = time.time()
@@ -532,43 +672,63 @@ async def reconcile_service(session, node_map, svc):
 
     now = time.time()
     last = last_scale_ts.get(svc_id, 0)
-    can_scale = (now - last) >= cooldown and svc_id not in pending_down
+    if dynamic_cooldown and warmups.tracking(svc_id):
+        # cooldown dinamico: termina quando le nuove repliche sono pronte + stabilizzazione
+        cooled, why = warmups.cooldown_over(svc_id, now, stabilization, cooldown)
+        if cooled and why == "timeout":
+            log.warning(f"{name} new replicas not ready within cooldown/learned startup latency; ending cooldown")
+        elif cooled:
+            lat = warmups.latency.get(svc_id)
+            if lat is not None:
+                log.info(f"{name} new capacity live, startup latency ~{lat:.0f}s")
+        if cooled:
+            # il cooldown dinamico è finito: il ramo fisso non deve riaprirlo dal timestamp dello scale-up
+            last_scale_ts[svc_id] = min(last, now - cooldown)
+    else:
+        cooled = (now - last) >= cooldown
+        if cooled:
+            warmups.clear(svc_id)
+    can_scale = cooled and svc_id not in pending_down
+
+    if group_follower_of(groups, labels, svc_id):
+        # repliche guidate dal leader del gruppo (apply_group_targets)
+        return
 
     new_replicas = desired
-    need_up = (avg_cpu > cpu_max) or (avg_mem > mem_max)
-    need_down = (avg_cpu < cpu_min) and (avg_mem < mem_min)
+    up_reasons = []
+    if avg_cpu > cpu_max:
+        up_reasons.append(f"cpu>{cpu_max}")
+    if avg_mem > mem_max:
+        up_reasons.append(f"mem>{mem_max}")
+    if throttle_max is not None and avg_throttle > throttle_max:
+        up_reasons.append(f"throttled>{throttle_max:g}%")
+    if psi_cpu_max is not None and avg_psi_cpu > psi_cpu_max:
+        up_reasons.append(f"psi.cpu>{psi_cpu_max:g}")
+    if psi_mem_max is not None and avg_psi_mem > psi_mem_max:
+        up_reasons.append(f"psi.mem>{psi_mem_max:g}")
+    need_up = bool(up_reasons)
+    need_down = (avg_cpu < cpu_min) and (avg_mem < mem_min) and not need_up
 
-    # Scale UP
+    # Scale UP: la decisione è raccolta e applicata dopo il ciclo, in ordine di priorità,
+    # così i servizi in competizione si spartiscono l'headroom disponibile
     if can_scale and need_up and desired < max_rep:
-        new_replicas = min(desired + 1, max_rep)
-        if new_replicas != desired:
-            try:
-                await update_service_replicas(session, svc_id, new_replicas)
-                last_scale_ts[svc_id] = now
-                if notifier and email_enabled_for_service(labels, default=bool(smtp_conf.get("enabled", False))):
-                    to = recipients_for_service(labels, smtp_conf)
-                    ev = {
-                        "ts_iso": iso_now(),
-                        "service": name, "service_id": svc_id,
-                        "action": "scale_up", "old": desired, "new": new_replicas,
-                        "cpu": avg_cpu, "mem": avg_mem,
-                        "reason": f"cpu>{cpu_max} or mem>{mem_max}",
-                        "to": to
-                    }
-                    await notifier.enqueue(ev)
-            except Exception as e:
-                log.error(f"{name} scale up failed: {e}")
-                if notifier and email_enabled_for_service(labels, default=bool(smtp_conf.get("enabled", False))):
-                    to = recipients_for_service(labels, smtp_conf)
-                    err = {
-                        "ts_iso": iso_now(),
-                        "service": name, "service_id": svc_id,
-                        "action": "scale_up",
-                        "reason": "Failure during upscaling",
-                        "details": str(e),
-                    }
-                    await notifier.send_error_now(err, to)
-            return
+        if capacity.ready:
+            pending = capacity.pending_tasks(svc_id)
+            if pending:
+                unsched = len(capacity.unschedulable_tasks(svc_id))
+                log.warning(f"{name} has {len(pending)} pending task(s) ({unsched} unschedulable); skipping scale-up")
+                return
+        scale_ups.append({
+            "service_id": svc_id, "name": name, "spec": spec, "labels": labels,
+            "desired": desired, "max_rep": max_rep, "priority": priority,
+            "pressure": scale_up_pressure(avg_cpu, avg_mem, cpu_max, mem_max,
+                                          avg_throttle, throttle_max,
+                                          avg_psi_cpu, psi_cpu_max, avg_psi_mem, psi_mem_max),
+            "cpu": avg_cpu, "mem": avg_mem,
+            "reason": " or ".join(up_reasons),
+            "task_ids": [t.get("ID") for t in tasks],
+        })
+        return
 
     # Scale DOWN
     if can_scale and need_down and desired > min_rep:
@@ -578,8 +738,9 @@ async def reconcile_service(session, node_map, svc):
         if pre_cmd:
             log.info(f"{name} scheduling graceful scale-down")
             last_scale_ts[svc_id] = now
+            warmups.clear(svc_id)
             pending_down[svc_id] = asyncio.create_task(
-                graceful_scale_down(session, node_map, svc_id, spec, name, labels, tasks,
+                graceful_scale_down(session, ctx["node_map"], svc_id, spec, name, labels, tasks,
                                     pre_cmd, pre_timeout, stop_timeout)
             )
             return
@@ -588,7 +749,9 @@ async def reconcile_service(session, node_map, svc):
             if new_replicas != desired:
                 try:
                     await update_service_replicas(session, svc_id, new_replicas)
+                    ctx["target"] = new_replicas
                     last_scale_ts[svc_id] = now
+                    warmups.clear(svc_id)
                     if notifier and email_enabled_for_service(labels, default=bool(smtp_conf.get("enabled", False))):
                         to = recipients_for_service(labels, smtp_conf)
                         ev = {
@@ -614,6 +777,178 @@ async def reconcile_service(session, node_map, svc):
                         await notifier.send_error_now(err, to)
                 return
 
+# -----------------------
+# Scale-up con cap sulla capacità del cluster
+# -----------------------
+async def apply_scale_ups(session, scale_ups, groups, ctx_by_id):
+    # priorità da label, poi il servizio più sotto pressione
+    for req in sorted(scale_ups, key=lambda r: (-r["priority"], -r["pressure"])):
+        svc_id, name, desired = req["service_id"], req["name"], req["desired"]
+        wanted = min(desired + 1, req["max_rep"]) - desired
+        if wanted <= 0:
+            continue
+        cp = capacity.checkpoint() if capacity.ready else None
+        if capacity.ready:
+            granted = capacity.claim(svc_id, req["spec"], wanted)
+            if granted <= 0:
+                log.warning(f"{name} scale-up skipped: no cluster headroom for reservations/placement")
+                continue
+            wanted = granted
+        # se è leader di un gruppo i follower salgono nello stesso passaggio, o nessuno sale
+        # i follower con uno scale-down graceful in corso restano fuori (come in apply_group_targets)
+        plan = [(c, cur, tgt) for c, cur, tgt in group_plan(groups, ctx_by_id, svc_id, desired + wanted)
+                if tgt > cur and c["svc"].get("ID") not in pending_down]
+        if capacity.ready:
+            short = [c for c, cur, tgt in plan
+                     if capacity.claim(c["svc"].get("ID"), c["svc"].get("Spec") or {}, tgt - cur) < tgt - cur]
+            if short:
+                capacity.rollback(cp)
+                names = ", ".join((c["svc"].get("Spec") or {}).get("Name") or "?" for c in short)
+                log.warning(f"{name} group scale-up skipped: no cluster headroom for {names}")
+                continue
+        # prima il leader: se il suo update fallisce i follower non si muovono
+        if not await scale_up_service(session, req, desired + wanted):
+            if cp is not None:
+                capacity.rollback(cp)
+            continue
+        ctx_by_id[svc_id]["target"] = desired + wanted
+        reason = f"group: {name} {desired} -> {desired + wanted}"
+        results = await asyncio.gather(*[scale_group_member(session, c, cur, tgt, reason)
+                                         for c, cur, tgt in plan])
+        if capacity.ready:
+            # la capacità prenotata dai follower non scalati torna disponibile
+            for (c, cur, tgt), ok in zip(plan, results):
+                if not ok:
+                    capacity.release(c["svc"].get("ID"), c["svc"].get("Spec") or {}, tgt - cur)
+
+async def apply_group_targets(session, groups, ctx_by_id):
+    """
+    Allinea i follower al target derivato dalle repliche correnti (o appena
+    decise) del leader: copre gli scale-down del leader e i drift, con un
+    unico passaggio di update per ciclo.
+    """
+    updates, claims = [], []
+    for gname, g in groups.items():
+        lc = ctx_by_id.get(g["leader"])
+        if not lc:
+            continue
+        lspec = lc["svc"].get("Spec") or {}
+        leader_n = lc.get("target", service_desired(lspec))
+        reason = f"group {gname}: leader {lspec.get('Name')} at {leader_n}"
+        for c, cur, tgt in group_plan(groups, ctx_by_id, g["leader"], leader_n):
+            fid = c["svc"].get("ID")
+            if tgt == cur or fid in pending_down:
+                continue
+            flabels = (c["svc"].get("Spec") or {}).get("Labels") or {}
+            if tgt < cur and not read_label(flabels, "scale_down.enable", True,
+                                            lambda v: str(v).lower() != "false"):
+                # follower sopra il target ma con scale-down disabilitato: resta com'è
+                continue
+            if tgt > cur and capacity.ready:
+                granted = capacity.claim(fid, c["svc"].get("Spec") or {}, tgt - cur)
+                if granted <= 0:
+                    log.warning(f"{(c['svc'].get('Spec') or {}).get('Name')} group scale-up skipped: no cluster headroom")
+                    continue
+                tgt = cur + granted
+            claims.append((c, max(0, tgt - cur) if capacity.ready else 0))
+            updates.append(scale_group_member(session, c, cur, tgt, reason))
+    results = await asyncio.gather(*updates)
+    for (c, claimed), ok in zip(claims, results):
+        if claimed and not ok:
+            capacity.release(c["svc"].get("ID"), c["svc"].get("Spec") or {}, claimed)
+
+async def scale_group_member(session, ctx, cur, target, reason):
+    """Porta un follower al target del gruppo; True se l'azione è stata avviata."""
+    svc = ctx["svc"]
+    svc_id = svc.get("ID")
+    spec = svc.get("Spec") or {}
+    labels = spec.get("Labels") or {}
+    name = spec.get("Name")
+    req = {"service_id": svc_id, "name": name, "labels": labels, "desired": cur,
+           "cpu": 0.0, "mem": 0.0, "reason": reason,
+           "task_ids": [t.get("ID") for t in ctx["tasks"]]}
+    if target > cur:
+        if await scale_up_service(session, req, target):
+            ctx["target"] = target
+            return True
+        return False
+    if not read_label(labels, "scale_down.enable", True, lambda v: str(v).lower() != "false"):
+        log.debug(f"{name} scale-down disabled by label")
+        return False
+    pre_cmd = read_label(labels, "pre_stop.cmd", "", str)
+    if pre_cmd:
+        # una replica per volta: il gruppo converge nei cicli successivi
+        log.info(f"{name} scheduling graceful scale-down ({reason})")
+        last_scale_ts[svc_id] = time.time()
+        warmups.clear(svc_id)
+        pending_down[svc_id] = asyncio.create_task(
+            graceful_scale_down(session, ctx["node_map"], svc_id, spec, name, labels, ctx["tasks"],
+                                pre_cmd, read_label(labels, "pre_stop.timeout", 600, int),
+                                read_label(labels, "stop.timeout", 30, int)))
+        return True
+    try:
+        await update_service_replicas(session, svc_id, target)
+        ctx["target"] = target
+        last_scale_ts[svc_id] = time.time()
+        warmups.clear(svc_id)
+        if notifier and email_enabled_for_service(labels, default=bool(smtp_conf.get("enabled", False))):
+            to = recipients_for_service(labels, smtp_conf)
+            ev = {
+                "ts_iso": iso_now(),
+                "service": name, "service_id": svc_id,
+                "action": "scale_down", "old": cur, "new": target,
+                "cpu": 0.0, "mem": 0.0,
+                "reason": reason,
+                "to": to
+            }
+            await notifier.enqueue(ev)
+        return True
+    except Exception as e:
+        log.error(f"{name} group scale down failed: {e}")
+        if notifier and email_enabled_for_service(labels, default=bool(smtp_conf.get("enabled", False))):
+            to = recipients_for_service(labels, smtp_conf)
+            err = {
+                "ts_iso": iso_now(),
+                "service": name, "service_id": svc_id,
+                "action": "scale_down",
+                "reason": "Failure during group downscaling",
+                "details": str(e),
+            }
+            await notifier.send_error_now(err, to)
+        return False
+
+async def scale_up_service(session, req, new_replicas):
+    svc_id, name, labels, desired = req["service_id"], req["name"], req["labels"], req["desired"]
+    try:
+        await update_service_replicas(session, svc_id, new_replicas)
+        last_scale_ts[svc_id] = time.time()
+        warmups.start(svc_id, req["task_ids"], new_replicas - desired)
+        if notifier and email_enabled_for_service(labels, default=bool(smtp_conf.get("enabled", False))):
+            to = recipients_for_service(labels, smtp_conf)
+            ev = {
+                "ts_iso": iso_now(),
+                "service": name, "service_id": svc_id,
+                "action": "scale_up", "old": desired, "new": new_replicas,
+                "cpu": req["cpu"], "mem": req["mem"],
+                "reason": req["reason"],
+                "to": to
+            }
+            await notifier.enqueue(ev)
+        return True
+    except Exception as e:
+        log.error(f"{name} scale up failed: {e}")
+        if notifier and email_enabled_for_service(labels, default=bool(smtp_conf.get("enabled", False))):
+            to = recipients_for_service(labels, smtp_conf)
+            err = {
+                "ts_iso": iso_now(),
+                "service": name, "service_id": svc_id,
+                "action": "scale_up",
+                "reason": "Failure during upscaling",
+                "details": str(e),
+            }
+            await notifier.send_error_now(err, to)
+        return False
+
 # -----------------------
 # Startup: attesa proxy pronti
 # -----------------------
@@ -631,7 +966,7 @@ async def wait_proxies_ready(session, max_wait_seconds: int) -> bool:
             ok_mgr = False
         # almeno un RO /info mappato
         try:
-            ro_bases = resolve_ro_proxies()
+            ro_bases = await resolve_ro_proxies()
             node_map = await build_nodeid_to_proxy(session, ro_bases)
             ok_ro = len(node_map) > 0
         except Exception:
@@ -650,6 +985,10 @@ async def main_loop():
     smtp_conf = load_smtp_config()
     log_smtp_config_debug(smtp_conf)
     notifier = EmailNotifier(smtp_conf)
+    if HEALTH_CYCLE_AGE_LIMIT != HEALTH_MAX_CYCLE_AGE:
+        log.warning(f"HEALTH_MAX_CYCLE_AGE={HEALTH_MAX_CYCLE_AGE}s too short for POLL_INTERVAL={POLL_INTERVAL}s; "
+                    f"using {HEALTH_CYCLE_AGE_LIMIT}s")
+    loop_monitor.start()
     asyncio.create_task(notifier.run_flush_loop())
     asyncio.create_task(start_admin_api(notifier, ADMIN_API_PORT))
 
@@ -675,14 +1014,28 @@ async def main_loop():
             sys.exit(1)
 
         while True:
+            t0 = time.monotonic()
             try:
-                ro_bases = resolve_ro_proxies()
+                ro_bases = await resolve_ro_proxies()
                 node_map = await build_nodeid_to_proxy(session, ro_bases)
                 services = await list_target_services(session)
-                tasks = [reconcile_service(session, node_map, s) for s in services]
+                await refresh_capacity(session)
+                batch = MetricsBatch()
+                ctxs = await asyncio.gather(
+                    *[collect_service_metrics(session, node_map, s, batch) for s in services])
+                _, aggregates = batch.compute()
+                groups = build_groups(services)
+                ctx_by_id = {c["svc"].get("ID"): c for c in ctxs}
+                scale_ups = []
+                tasks = [reconcile_service(session, c, aggregates.get(c["svc"].get("ID")), scale_ups, groups)
+                         for c in ctxs]
                 await asyncio.gather(*tasks)
+                await apply_scale_ups(session, scale_ups, groups, ctx_by_id)
+                await apply_group_targets(session, groups, ctx_by_id)
                 await notifier.flush_if_due()
+                loop_monitor.cycle_done(time.monotonic() - t0, ok=True)
             except Exception as e:
+                loop_monitor.cycle_done(time.monotonic() - t0, ok=False)
                 log.error(f"reconcile error: {e}")
                 if smtp_conf.get("enabled"):
                     to = smtp_conf.get("to_default") or []
@@ -695,6 +1048,9 @@ async def main_loop():
                             "details": str(e),
                         }
                         await notifier.send_error_now(err, to)
+            elapsed = time.monotonic() - t0
+            if elapsed > POLL_INTERVAL:
+                log.warning(f"reconcile cycle took {elapsed:.1f}s, longer than POLL_INTERVAL={POLL_INTERVAL}s")
             await asyncio.sleep(POLL_INTERVAL)
 
 if __name__ == "__main__":
@@ -32,6 +32,69 @@ def mem_percent(stats: dict) -> float:
     limit = float(mem.get("limit", 1) or 1)
     return (usage / limit) * 100.0
 
+def mem_inactive_file(memory_stats: dict):
+    """Page cache inattiva: 'total_inactive_file' su cgroup v1, 'inactive_file' su v2."""
+    mstats = (memory_stats or {}).get("stats", {}) or {}
+    if "total_inactive_file" in mstats:
+        return mstats.get("total_inactive_file") or 0
+    return mstats.get("inactive_file") or 0
+
+def mem_working_set_bytes(stats: dict) -> float:
+    """
+    Working set come fa docker stats: usage meno la page cache inattiva,
+    'inactive_file' su cgroup v2, 'total_inactive_file' su cgroup v1.
+    """
+    mem = stats.get("memory_stats", {}) or {}
+    usage = float(mem.get("usage", 0) or 0)
+    inactive = float(mem_inactive_file(mem))
+    return usage - inactive if inactive < usage else usage
+
+def mem_working_set_percent(stats: dict) -> float:
+    mem = stats.get("memory_stats", {}) or {}
+    limit = float(mem.get("limit", 1) or 1)
+    return (mem_working_set_bytes(stats) / limit) * 100.0
+
+def cpu_throttling_percent(stats: dict) -> float:
+    """
+    Percentuale di periodi CFS in cui il container è stato throttled,
+    calcolata sul delta tra cpu_stats e precpu_stats.throttling_data.
+    Solo se il campione precedente manca del tutto si usano i contatori
+    cumulativi; nessun periodo nella finestra (container idle) vale 0.
+    """
+    cur = (stats.get("cpu_stats", {}) or {}).get("throttling_data", {}) or {}
+    pre = (stats.get("precpu_stats", {}) or {}).get("throttling_data")
+    periods = float(cur.get("periods", 0) or 0)
+    throttled = float(cur.get("throttled_periods", 0) or 0)
+    if pre:
+        periods -= float(pre.get("periods", 0) or 0)
+        throttled -= float(pre.get("throttled_periods", 0) or 0)
+    if periods <= 0.0:
+        return 0.0
+    return max(0.0, min(100.0, (throttled / periods) * 100.0))
+
+_PSI_SECTIONS = {"cpu": "cpu_stats", "memory": "memory_stats", "io": "blkio_stats"}
+
+def psi_some_avg10(stats: dict, resource: str):
+    """
+    Pressure stall info 'some avg10' per cpu/memory/io se il daemon la espone
+    nelle stats (cgroup v2); None se non disponibile.
+    """
+    data = stats.get(_PSI_SECTIONS.get(resource), {}) or {}
+    psi = data.get("psi") or data.get("pressure")
+    if not psi:
+        return None
+    some = psi.get("some") or psi.get("Some") or {}
+    val = some.get("avg10", some.get("Avg10"))
+    try:
+        return float(val) if val is not None else None
+    except (TypeError, ValueError):
+        return None
+
+def normalize_cpu_percent(raw_pct: float, limit_cpus: float) -> float:
+    if limit_cpus <= 0:
+        return max(0.0, min(100.0, raw_pct))
+    return max(0.0, min(100.0, raw_pct / limit_cpus))
+
 def avg(values):
     vals = [v for v in values if v is not None]
     return (sum(vals) / len(vals)) if vals else 0.0
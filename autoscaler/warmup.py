@@ -0,0 +1,88 @@
+# warmup.py
+
+import time
+
+def container_ready(ins: dict) -> bool:
+    """
+    Una replica è pronta quando il container è running e, se ha un
+    healthcheck, lo stato di health è 'healthy'.
+    """
+    state = (ins or {}).get("State") or {}
+    if not state.get("Running"):
+        return False
+    health = state.get("Health")
+    if not health:
+        return True
+    return health.get("Status") == "healthy"
+
+class WarmupTracker:
+    """
+    Traccia i task creati da ogni scale-up finché non diventano running e
+    healthy, e impara per servizio la latenza di avvio (EWMA).
+    Il cooldown dinamico termina quando la nuova capacità è attiva più un
+    margine di stabilizzazione, entro il limite massimo dato dal cooldown;
+    finché le repliche non sono pronte il limite si estende alla latenza
+    appresa più la stabilizzazione, per non riscalare su metriche vecchie.
+    """
+
+    def __init__(self, alpha: float = 0.3):
+        self.alpha = float(alpha)
+        self.actions = {}   # service_id -> azione di scale-up in corso
+        self.latency = {}   # service_id -> latenza di avvio appresa (s)
+
+    def start(self, service_id: str, known_task_ids, expected: int, now=None):
+        self.actions[service_id] = {
+            "ts": time.time() if now is None else now,
+            "known": set(known_task_ids or []),
+            "expected": max(0, int(expected)),
+            "live": {},     # task_id -> ts in cui è diventato pronto
+        }
+
+    def clear(self, service_id: str):
+        self.actions.pop(service_id, None)
+
+    def tracking(self, service_id: str) -> bool:
+        return service_id in self.actions
+
+    def is_warming(self, service_id: str, task_id: str) -> bool:
+        """True se il task è nato dall'ultimo scale-up e non è ancora pronto."""
+        a = self.actions.get(service_id)
+        if not a or not task_id:
+            return False
+        return task_id not in a["known"] and task_id not in a["live"]
+
+    def mark_live(self, service_id: str, task_id: str, now=None):
+        a = self.actions.get(service_id)
+        if not a or task_id in a["live"]:
+            return
+        now = time.time() if now is None else now
+        a["live"][task_id] = now
+        if len(a["live"]) == a["expected"]:
+            sample = now - a["ts"]
+            prev = self.latency.get(service_id)
+            self.latency[service_id] = sample if prev is None else (
+                self.alpha * sample + (1 - self.alpha) * prev)
+
+    def all_live(self, service_id: str) -> bool:
+        a = self.actions.get(service_id)
+        return bool(a) and len(a["live"]) >= a["expected"]
+
+    def cooldown_over(self, service_id: str, now: float, stabilization: float, max_cooldown: float):
+        """
+        Restituisce (finito, motivo). Quando il cooldown termina l'azione
+        viene rimossa dal tracking.
+        """
+        a = self.actions.get(service_id)
+        if not a:
+            return True, "idle"
+        if self.all_live(service_id):
+            live_ts = max(a["live"].values()) if a["live"] else a["ts"]
+            if now >= min(live_ts + stabilization, a["ts"] + max_cooldown):
+                self.clear(service_id)
+                return True, "live"
+            return False, "stabilizing"
+        bound = max(max_cooldown, self.latency.get(service_id, 0.0) + stabilization)
+        if now - a["ts"] >= bound:
+            self.clear(service_id)
+            return True, "timeout"
+        return False, "warming"